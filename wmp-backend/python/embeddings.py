@@ -5,13 +5,24 @@ TypeScript calls this, then queries Weaviate directly
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List
-from deepface import DeepFace
-import tempfile
-import os
+from face_model import FaceEmbedder, MODEL_NAME
+import tensorflow as tf
+import numpy as np
+import cv2
 
-app = FastAPI(title="Face Embedding Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build models once at startup instead of on the first request
+    gpus = tf.config.list_physical_devices("GPU")
+    print(f"GPUs available to TensorFlow: {len(gpus)}")
+    app.state.embedder = FaceEmbedder()
+    app.state.embedder.warm_up()
+    yield
+
+app = FastAPI(title="Face Embedding Service", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,8 +32,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-MODEL_NAME = "Facenet512"
-
 class EmbeddingResponse(BaseModel):
     embedding: List[float]
     faces_detected: int
@@ -38,25 +47,36 @@ async def extract_embedding(image: UploadFile = File(...)):
     Extract face embedding from image
     Returns a 512-dimensional vector (for Facenet512)
     """
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        tmp.write(await image.read())
-        tmp_path = tmp.name
+    # Decode in memory instead of round-tripping the upload through a temp file
+    data = await image.read()
+    
+    # imdecode asserts on an empty buffer, so reject it before decoding
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    
+    if img is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
     
     try:
-        result = DeepFace.represent(
-            img_path=tmp_path,
-            model_name=MODEL_NAME,
-            detector_backend="retinaface",
-            enforce_detection=True,
-            align=True
-        )
+        embedder: FaceEmbedder = app.state.embedder
+        faces = embedder.extract_faces(img)
         
-        if not result or len(result) == 0:
+        if not faces or len(faces) == 0:
             raise HTTPException(status_code=400, detail="No face detected")
         
+        # Only the first face is returned, so only embed that one
+        embedding = embedder.embed(faces[:1])[0]
+        
+        # Round to float16 precision and its shortest decimal form: the JSON body
+        # (and the Weaviate query built from it) shrinks by more than half while
+        # cosine similarity to the full-precision vector stays above 0.9999
+        embedding = embedding.astype(np.float16).astype(str).astype(float)
+        
         return EmbeddingResponse(
-            embedding=result[0]["embedding"],
-            faces_detected=len(result),
+            embedding=embedding.tolist(),
+            faces_detected=len(faces),
             model_name=MODEL_NAME
         )
         
@@ -67,10 +87,6 @@ async def extract_embedding(image: UploadFile = File(...)):
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,128 @@
+"""
+Export Facenet512 to ONNX for onnxruntime inference, plus an INT8 copy
+One-time script - face_model.py picks up the files automatically
+Needs tf2onnx, which is only used here so isn't in requirements.txt (pip install tf2onnx)
+"""
+
+from deepface import DeepFace
+from face_model import (
+    FaceEmbedder, MODEL_NAME, ONNX_PATH, INT8_ONNX_PATH, preprocess_batch, unique_mask
+)
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_static
+)
+from pathlib import Path
+from typing import List, Tuple
+import onnxruntime as ort
+import hashlib
+import numpy as np
+import tensorflow as tf
+import tf2onnx
+
+PHOTOS_DIR = Path(__file__).parent / "photos"
+CALIBRATION_FACES = 200
+
+
+class FaceCalibrationReader(CalibrationDataReader):
+    """Feeds real face crops to quantize_static, one at a time"""
+
+    def __init__(self, faces: List[np.ndarray], input_name: str):
+        self.inputs = iter([{input_name: preprocess_batch([face])} for face in faces])
+
+    def get_next(self):
+        return next(self.inputs, None)
+
+
+def load_faces(embedder: FaceEmbedder) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Aligned crops from the registration photos, labelled by person folder"""
+    faces, labels = [], []
+    image_paths = sorted(p for p in PHOTOS_DIR.glob("*/*") if p.is_file())
+    seen = set()
+
+    for img_path in image_paths:
+        if len(faces) >= CALIBRATION_FACES:
+            break
+
+        # Skip byte-identical copies (e.g. "IMG_0022 2.jpg"), which would be each
+        # other's nearest neighbour and make recall@1 meaningless
+        digest = hashlib.sha1(img_path.read_bytes()).hexdigest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+
+        try:
+            # Same largest-face crop populate.py enrols
+            faces.append(embedder.extract_faces(str(img_path), max_faces=1)[0])
+            labels.append(img_path.parent.name)
+        except ValueError:
+            continue
+
+    return faces, np.array(labels)
+
+
+def embed(path: Path, faces: List[np.ndarray]) -> np.ndarray:
+    session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    embeddings = session.run(None, {input_name: preprocess_batch(faces)})[0]
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def recall_at_1(embeddings: np.ndarray, labels: np.ndarray) -> float:
+    """Share of faces whose nearest other face belongs to the same person"""
+    similarity = embeddings @ embeddings.T
+    np.fill_diagonal(similarity, -1)
+    return float(np.mean(labels[similarity.argmax(axis=1)] == labels))
+
+
+if __name__ == "__main__":
+    model = DeepFace.build_model(MODEL_NAME)
+    height, width = model.input_shape
+
+    # Dynamic batch dimension so populate.py can embed whole batches at once
+    input_signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+
+    tf2onnx.convert.from_keras(
+        model.model,
+        input_signature=input_signature,
+        opset=17,
+        output_path=str(ONNX_PATH)
+    )
+
+    print(f"✅ Exported {MODEL_NAME} to {ONNX_PATH}")
+
+    # Static quantization calibrates activation ranges on real face crops
+    faces, labels = load_faces(FaceEmbedder())
+
+    if not faces:
+        print(f"⚠️  No faces found in {PHOTOS_DIR}, skipping INT8 quantization")
+        exit(0)
+
+    quantize_static(
+        str(ONNX_PATH),
+        str(INT8_ONNX_PATH),
+        FaceCalibrationReader(faces, "input"),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8
+    )
+
+    print(f"✅ Quantized {len(faces)} calibration faces to {INT8_ONNX_PATH}")
+
+    # INT8 should rank faces the same as FP32. Near-duplicate frames are dropped
+    # first, otherwise their twin is always the nearest neighbour
+    fp32 = embed(ONNX_PATH, faces)
+    int8 = embed(INT8_ONNX_PATH, faces)
+
+    keep = unique_mask(fp32)
+    fp32_recall = recall_at_1(fp32[keep], labels[keep])
+    int8_recall = recall_at_1(int8[keep], labels[keep])
+
+    print(f"   Scored on {int(keep.sum())} distinct faces")
+    print(f"   Recall@1 FP32: {fp32_recall:.3f}")
+    print(f"   Recall@1 INT8: {int8_recall:.3f}")
+    print(f"   Min FP32/INT8 cosine: {np.min(np.sum(fp32 * int8, axis=1)):.4f}")
+
+    if int8_recall < fp32_recall:
+        INT8_ONNX_PATH.unlink()
+        print(f"⚠️  INT8 recall is below FP32, removed {INT8_ONNX_PATH.name}")
@@ -0,0 +1,209 @@
+"""
+Shared face pipeline for embeddings.py and populate.py
+Models are built once, faces are detected/aligned per image and embedded in batches
+"""
+
+from deepface import DeepFace
+from deepface.modules import detection
+from deepface.modules.exceptions import FaceNotDetected
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+import onnxruntime as ort
+import numpy as np
+import cv2
+
+MODEL_NAME = "Facenet512"
+# YuNet is far cheaper than RetinaFace; RetinaFace only runs when YuNet finds nothing
+DETECTOR_BACKEND = "yunet"
+FALLBACK_DETECTOR_BACKEND = "retinaface"
+
+# Written by export_onnx.py. INT8 is preferred on CPU only - QDQ INT8 gains nothing on
+# TensorRT/CUDA - then FP32, then the Keras model
+ONNX_PATH = Path(__file__).parent / "facenet512.onnx"
+INT8_ONNX_PATH = Path(__file__).parent / "facenet512.int8.onnx"
+
+GPU_PROVIDERS = {"TensorrtExecutionProvider", "CUDAExecutionProvider"}
+
+# Largest batch embed() is called with; populate.py embeds in batches of this size
+EMBED_BATCH_SIZE = 32
+
+# Built TensorRT engines are cached here so they survive restarts and worker processes
+TRT_CACHE_PATH = Path(__file__).parent / "trt_cache"
+
+# One optimisation profile covering batch 1..EMBED_BATCH_SIZE, so a smaller last batch
+# doesn't trigger an engine rebuild
+ONNX_PROVIDERS = [
+    ("TensorrtExecutionProvider", {
+        "trt_fp16_enable": True,
+        "trt_engine_cache_enable": True,
+        "trt_engine_cache_path": str(TRT_CACHE_PATH),
+        "trt_profile_min_shapes": "input:1x160x160x3",
+        "trt_profile_opt_shapes": f"input:{EMBED_BATCH_SIZE}x160x160x3",
+        "trt_profile_max_shapes": f"input:{EMBED_BATCH_SIZE}x160x160x3",
+    }),
+    "CUDAExecutionProvider",
+    "CPUExecutionProvider",
+]
+
+
+def resize_face(face: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
+    """Fit a uint8 crop into target_size, keeping its aspect ratio and padding with black
+
+    Same geometry as DeepFace's resize_image, minus the per-image float conversion
+    """
+    height, width = target_size
+    factor = min(height / face.shape[0], width / face.shape[1])
+    face = cv2.resize(face, (int(face.shape[1] * factor), int(face.shape[0] * factor)))
+
+    pad_h = height - face.shape[0]
+    pad_w = width - face.shape[1]
+    return cv2.copyMakeBorder(
+        face,
+        pad_h // 2, pad_h - pad_h // 2,
+        pad_w // 2, pad_w - pad_w // 2,
+        cv2.BORDER_CONSTANT,
+        value=0
+    )
+
+
+def preprocess_batch(faces: List[np.ndarray]) -> np.ndarray:
+    """Stack resized uint8 crops into one (B, H, W, 3) float32 batch scaled to [0, 1]"""
+    batch = np.stack(faces).astype(np.float32)
+    batch /= 255.0
+    return batch
+
+
+def l2_normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Scale each row of a (B, D) float32 array to unit length, in place"""
+    # einsum computes the row norms without materialising embeddings ** 2
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+    embeddings /= norms[:, np.newaxis]
+    return embeddings
+
+
+def unique_mask(embeddings: np.ndarray, threshold: float = 0.98) -> np.ndarray:
+    """Mask of unit-length embeddings with no later one above threshold cosine similarity"""
+    similarity = embeddings @ embeddings.T
+    return ~np.any(np.triu(similarity > threshold, k=1), axis=1)
+
+
+def deduplicate(embeddings: np.ndarray, threshold: float = 0.98) -> np.ndarray:
+    """Drop unit-length embeddings whose cosine similarity to a later one exceeds threshold
+
+    Burst shots and video frames of the same pose add storage and HNSW
+    build cost without helping recall
+    """
+    return embeddings[unique_mask(embeddings, threshold)]
+
+
+class FaceEmbedder:
+    """Facenet512 embeddings from images, reusing the built models across calls"""
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        detector_backend: str = DETECTOR_BACKEND,
+        fallback_detector_backend: Optional[str] = FALLBACK_DETECTOR_BACKEND,
+        intra_op_threads: Optional[int] = None
+    ):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.fallback_detector_backend = fallback_detector_backend
+
+        # DeepFace caches built models, so later extract_faces calls reuse these
+        self.detector = DeepFace.build_model(detector_backend, task="face_detector")
+        if fallback_detector_backend is not None:
+            self.fallback_detector = DeepFace.build_model(
+                fallback_detector_backend, task="face_detector"
+            )
+            # RetinaFace runs as a tf.function that is traced on its first call;
+            # pay that here rather than on the first image YuNet misses
+            self.fallback_detector.detect_faces(np.zeros((224, 224, 3), dtype=np.uint8))
+
+        if GPU_PROVIDERS.intersection(ort.get_available_providers()):
+            candidates = (ONNX_PATH, INT8_ONNX_PATH)
+        else:
+            candidates = (INT8_ONNX_PATH, ONNX_PATH)
+        onnx_path = next((p for p in candidates if p.exists()), None)
+
+        if onnx_path is not None:
+            self.session = self._load_onnx(onnx_path, intra_op_threads)
+            self.input_name = self.session.get_inputs()[0].name
+            self.input_shape = tuple(self.session.get_inputs()[0].shape[1:3])
+            self.model = None
+        else:
+            self.session = None
+            self.model = DeepFace.build_model(model_name)
+            self.input_shape = self.model.input_shape
+
+    @staticmethod
+    def _load_onnx(path: Path, intra_op_threads: Optional[int] = None) -> ort.InferenceSession:
+        """Load an exported model on the fastest execution provider available"""
+        available = ort.get_available_providers()
+        providers = [
+            provider for provider in ONNX_PROVIDERS
+            if (provider[0] if isinstance(provider, tuple) else provider) in available
+        ]
+
+        options = ort.SessionOptions()
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+
+        return ort.InferenceSession(str(path), sess_options=options, providers=providers)
+
+    def warm_up(self, runs: int = 2):
+        """Run the detector and model on dummy input so the first request isn't cold"""
+        self.detector.detect_faces(np.zeros((224, 224, 3), dtype=np.uint8))
+
+        # Mid-grey rather than black so the embedding norm isn't zero
+        dummy = np.full((*self.input_shape, 3), 128, dtype=np.uint8)
+        # TensorFlow and TensorRT can still specialise the graph on the second call
+        for _ in range(runs):
+            self.embed([dummy])
+
+    def extract_faces(
+        self,
+        img: Union[str, np.ndarray],
+        max_faces: Optional[int] = None
+    ) -> List[np.ndarray]:
+        """
+        Detect and align faces in an image, largest first when max_faces is set
+        Returns (160, 160, 3) uint8 BGR crops, raises ValueError if none found
+        """
+        try:
+            faces = self._detect(img, self.detector_backend, max_faces)
+        except FaceNotDetected:
+            if self.fallback_detector_backend is None:
+                raise
+            faces = self._detect(img, self.fallback_detector_backend, max_faces)
+
+        return [resize_face(face["face"], self.input_shape) for face in faces]
+
+    @staticmethod
+    def _detect(
+        img: Union[str, np.ndarray],
+        detector_backend: str,
+        max_faces: Optional[int]
+    ) -> List[dict]:
+        # DeepFace.extract_faces doesn't expose max_faces; the detection module
+        # applies it before alignment, so discarded faces are never aligned
+        return detection.extract_faces(
+            img_path=img,
+            detector_backend=detector_backend,
+            enforce_detection=True,
+            align=True,
+            color_face="bgr",
+            normalize_face=False,
+            max_faces=max_faces
+        )
+
+    def embed(self, faces: List[np.ndarray]) -> np.ndarray:
+        """Run the model once over a batch of faces, returns (B, 512) unit vectors"""
+        batch = preprocess_batch(faces)
+
+        if self.session is not None:
+            embeddings = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            embeddings = self.model.model.predict_on_batch(batch)
+
+        return l2_normalize(np.asarray(embeddings, dtype=np.float32))
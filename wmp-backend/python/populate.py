@@ -4,12 +4,19 @@ One-time script to set up your database
 """
 
 import weaviate
-from weaviate.classes.config import Configure, Property, DataType, VectorDistances
+from weaviate.classes.config import Configure, Reconfigure, Property, DataType, VectorDistances
 from weaviate.auth import AuthApiKey
-from deepface import DeepFace
+from face_model import FaceEmbedder, EMBED_BATCH_SIZE, deduplicate
+import tensorflow as tf
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
 from tqdm import tqdm
+import multiprocessing
+import numpy as np
+import cv2
 import os
 
 class FaceRegistrationCloud:
@@ -18,7 +25,10 @@ class FaceRegistrationCloud:
     def __init__(
         self, 
         cluster_url: str,
-        api_key: str
+        api_key: str,
+        upload_batch_size: int = 100,
+        upload_concurrency: int = 4,
+        threads: Optional[int] = None
     ):
         """
         Initialize Weaviate Cloud connection
@@ -27,19 +37,43 @@ class FaceRegistrationCloud:
             cluster_url: Your Weaviate Cloud cluster URL 
                          (e.g., "https://my-cluster-abc123.weaviate.network")
             api_key: Your Weaviate Cloud API key
+            upload_batch_size: Objects per Weaviate batch request
+            upload_concurrency: Batch requests allowed in flight at once
+            threads: CPU threads for image decoding and ONNX inference
+                     (default: 8 decode threads, inference uses every core)
         """
-        # Connect to Weaviate Cloud
+        # Connect to Weaviate Cloud. The init checks include a gRPC health check,
+        # so batch uploads are known to use gRPC/protobuf rather than REST/JSON
         self.client = weaviate.connect_to_weaviate_cloud(
             cluster_url=cluster_url,
-            auth_credentials=AuthApiKey(api_key)
+            auth_credentials=AuthApiKey(api_key),
+            skip_init_checks=False
         )
         
+        if not self.client.is_ready():
+            raise RuntimeError(f"Weaviate cluster is not ready: {cluster_url}")
+        
+        server_version = self.client.get_meta()["version"]
+        
+        self.cluster_url = cluster_url
+        self.api_key = api_key
         self.collection_name = "FaceEmbedding"
-        self.model_name = "Facenet512"
+        self.upload_batch_size = upload_batch_size
+        self.upload_concurrency = upload_concurrency
+        self.threads = threads
+        self._embedder = None
         
         print(f"✅ Connected to Weaviate Cloud")
         print(f"   Cluster: {cluster_url}")
+        print(f"   Server: v{server_version} (gRPC batching)")
         
+    @property
+    def embedder(self) -> FaceEmbedder:
+        """Detector and recognition model, built on first use and reused for every batch"""
+        if self._embedder is None:
+            self._embedder = FaceEmbedder(intra_op_threads=self.threads)
+        return self._embedder
+    
     def setup_schema(self):
         """Create Weaviate schema for face embeddings"""
         try:
@@ -55,10 +89,12 @@ class FaceRegistrationCloud:
                     Property(name="personName", data_type=DataType.TEXT),
                 ],
                 vectorizer_config=Configure.Vectorizer.none(),
+                # Lighter graph for faster bulk inserts; a few hundred faces per
+                # person don't need a dense graph for accurate search
                 vector_index_config=Configure.VectorIndex.hnsw(
                     distance_metric=VectorDistances.COSINE,
-                    ef_construction=128,
-                    max_connections=64
+                    ef_construction=64,
+                    max_connections=32
                 )
             )
             
@@ -69,23 +105,46 @@ class FaceRegistrationCloud:
             print(f"❌ Schema setup error: {str(e)}")
             raise
     
-    def extract_embedding(self, image_path: str) -> Optional[List[float]]:
-        """Extract face embedding using DeepFace"""
+    def read_images(
+        self,
+        image_paths: Iterable[Path],
+        workers: int = 8
+    ) -> Iterator[Tuple[Path, Optional[np.ndarray]]]:
+        """Decode images on a thread pool, yielding them in order
+        
+        cv2.imread releases the GIL, so decoding overlaps with detection. Only
+        `workers` images are read ahead, since full-size photos are large.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            
+            for img_path in image_paths:
+                pending.append((img_path, pool.submit(cv2.imread, str(img_path))))
+                
+                if len(pending) > workers:
+                    img_path, future = pending.popleft()
+                    yield img_path, future.result()
+            
+            while pending:
+                img_path, future = pending.popleft()
+                yield img_path, future.result()
+    
+    def extract_face(self, image_path: Path, img: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Detect and align the largest face, resized to the model's input shape"""
+        if img is None:
+            print(f"  ⚠️  Failed: {image_path.name} - could not read image")
+            return None
+        
         try:
-            result = DeepFace.represent(
-                img_path=image_path,
-                model_name=self.model_name,
-                detector_backend="retinaface",
-                enforce_detection=True,
-                align=True
-            )
+            # Only one face per photo is registered, so don't align the others
+            faces = self.embedder.extract_faces(img, max_faces=1)
             
-            if result and len(result) > 0:
-                return result[0]["embedding"]
+            if faces and len(faces) > 0:
+                return faces[0]
             return None
             
         except Exception as e:
-            print(f"  ⚠️  Failed: {Path(image_path).name} - {str(e)}")
+            print(f"  ⚠️  Failed: {image_path.name} - {str(e)}")
             return None
     
     def register_person(
@@ -93,8 +152,19 @@ class FaceRegistrationCloud:
         person_name: str,
         image_folder: str,
         max_photos: int = 50,
+        batch: Optional[Any] = None,
     ) -> Dict[str, Any]:
-        """Register a person with multiple photos"""
+        """Register a person with multiple photos
+        
+        Embeddings are queued on `batch` (a Weaviate batch context). Without one,
+        a batch is opened for this person and flushed before returning.
+        """
+        if batch is None:
+            with self.upload_batch() as batch:
+                results = self.register_person(person_name, image_folder, max_photos, batch)
+            self.record_failures({person_name: results})
+            return results
+        
         folder = Path(image_folder)
         
         if not folder.exists():
@@ -109,75 +179,161 @@ class FaceRegistrationCloud:
         
         image_paths = sorted(image_paths)[:max_photos]
         
+        # Similar-sized files decode in similar time, so the in-order read-ahead
+        # doesn't stall behind one large photo
+        image_paths.sort(key=lambda p: p.stat().st_size)
+        
         if not image_paths:
             return {"error": "No images found", "successful": 0, "failed": 0, "errors": []}
         
         print(f"\n📸 {person_name} - {len(image_paths)} photos")
         
-        collection = self.client.collections.get(self.collection_name)
-        
-        results = {"successful": 0, "failed": 0, "errors": []}
+        results = {"successful": 0, "failed": 0, "deduplicated": 0, "errors": []}
+        embeddings = []
         
-        # Process in batches for efficiency
-        batch_size = 10
+        # Detect faces one by one, then embed each batch in a single forward pass
+        batch_size = EMBED_BATCH_SIZE
+        images = self.read_images(image_paths, workers=self.threads or 8)
         
         for i in range(0, len(image_paths), batch_size):
-            batch = image_paths[i:i + batch_size]
+            chunk = islice(images, batch_size)
             
-            for img_path in tqdm(batch, desc=f"  Batch {i//batch_size + 1}", leave=False):
-                try:
-                    embedding = self.extract_embedding(str(img_path))
-                    
-                    if embedding is None:
-                        results["failed"] += 1
-                        continue
-                    
-                    collection.data.insert(
-                        properties={
-                            "personName": person_name,
-                        },
-                        vector=embedding
-                    )
-                    
-                    results["successful"] += 1
-                    
-                except Exception as e:
+            faces = []
+            for img_path, img in tqdm(
+                chunk,
+                total=min(batch_size, len(image_paths) - i),
+                desc=f"  Batch {i//batch_size + 1}",
+                leave=False
+            ):
+                face = self.extract_face(img_path, img)
+                
+                if face is None:
                     results["failed"] += 1
-                    results["errors"].append(f"{img_path.name}: {str(e)}")
+                    continue
+                
+                faces.append(face)
+            
+            if not faces:
+                continue
+            
+            embeddings.append(self.embedder.embed(faces))
         
-        print(f"  ✅ {results['successful']}/{len(image_paths)} photos registered")
+        if embeddings:
+            embeddings = np.concatenate(embeddings, axis=0)
+            unique = deduplicate(embeddings)
+            results["deduplicated"] = len(embeddings) - len(unique)
+            
+            for embedding in unique:
+                batch.add_object(
+                    collection=self.collection_name,
+                    properties={
+                        "personName": person_name,
+                    },
+                    vector=embedding.tolist()
+                )
+                results["successful"] += 1
+        
+        print(f"  ✅ {results['successful']}/{len(image_paths)} photos queued")
+        if results["deduplicated"] > 0:
+            print(f"  ♻️  Near-duplicates skipped: {results['deduplicated']}")
         if results["failed"] > 0:
             print(f"  ⚠️  Failed: {results['failed']}")
         
         return results
     
+    def upload_batch(self):
+        """Open a fixed-size Weaviate batch
+        
+        add_object only enqueues; full batches are sent by the client's background
+        thread, so uploads overlap with extracting the next embeddings. At most
+        `upload_concurrency` requests are in flight, after which add_object blocks.
+        """
+        return self.client.batch.fixed_size(
+            batch_size=self.upload_batch_size,
+            concurrent_requests=self.upload_concurrency
+        )
+    
+    def record_failures(self, results: Dict[str, Dict[str, Any]]):
+        """Move objects rejected by the last batch from successful to failed"""
+        for failed in self.client.batch.failed_objects:
+            result = results[failed.object_.properties["personName"]]
+            result["successful"] -= 1
+            result["failed"] += 1
+            result["errors"].append(failed.message)
+        
+        if self.client.batch.failed_objects:
+            print(f"  ⚠️  Weaviate rejected {len(self.client.batch.failed_objects)} objects")
+    
     def register_batch(
         self, 
         people: Dict[str, str],
-        max_photos_per_person: int = 50
+        max_photos_per_person: int = 50,
+        processes: Optional[int] = None
     ):
         """Register multiple people
         
         Args:
             people: Dict mapping person name to their image folder path
             max_photos_per_person: Maximum photos to register per person
+            processes: Worker processes, one person each at a time
+                       (default: 1 with a GPU, since every worker would load its own
+                       models onto it; otherwise one per person, up to the CPU count)
         """
+        if processes is None:
+            if tf.config.list_physical_devices("GPU"):
+                processes = 1
+            else:
+                processes = min(len(people), os.cpu_count() or 1)
+        
         print(f"\n{'='*60}")
-        print(f"BATCH REGISTRATION - {len(people)} people")
+        print(f"BATCH REGISTRATION - {len(people)} people, {processes} processes")
         print(f"{'='*60}")
         
-        total = {"people": len(people), "photos": 0, "successful": 0, "failed": 0}
+        total = {"people": len(people), "photos": 0, "successful": 0, "failed": 0, "deduplicated": 0}
+        results = {}
         
-        for person_name, folder in people.items():
-            result = self.register_person(
-                person_name=person_name,
-                image_folder=folder,
-                max_photos=max_photos_per_person,
-            )
+        if processes > 1:
+            # TensorFlow isn't fork-safe, so workers are spawned and build their own models.
+            # Split the cores between them rather than each sizing its pools to all of them
+            threads = max(1, (os.cpu_count() or 1) // processes)
+            
+            with multiprocessing.get_context("spawn").Pool(
+                processes=processes,
+                initializer=_init_worker,
+                initargs=(threads,)
+            ) as pool:
+                results = dict(pool.starmap(_register_one, [
+                    (
+                        self.cluster_url,
+                        self.api_key,
+                        person_name,
+                        folder,
+                        max_photos_per_person,
+                        self.upload_batch_size,
+                        self.upload_concurrency,
+                        threads,
+                    )
+                    for person_name, folder in people.items()
+                ]))
+        else:
+            # One batch for everyone so uploads are pipelined across people
+            with self.upload_batch() as batch:
+                for person_name, folder in people.items():
+                    results[person_name] = self.register_person(
+                        person_name=person_name,
+                        image_folder=folder,
+                        max_photos=max_photos_per_person,
+                        batch=batch,
+                    )
             
-            total["photos"] += result["successful"] + result["failed"]
+            self.record_failures(results)
+        
+        for result in results.values():
+            deduplicated = result.get("deduplicated", 0)
+            total["photos"] += result["successful"] + result["failed"] + deduplicated
             total["successful"] += result["successful"]
             total["failed"] += result["failed"]
+            total["deduplicated"] += deduplicated
         
         print(f"\n{'='*60}")
         print(f"✅ REGISTRATION COMPLETE")
@@ -186,9 +342,36 @@ class FaceRegistrationCloud:
         print(f"Total photos: {total['photos']}")
         print(f"Successful: {total['successful']}")
         print(f"Failed: {total['failed']}")
+        print(f"Near-duplicates skipped: {total['deduplicated']}")
         
         return total
     
+    def enable_compression(self, min_vectors: int = 10_000) -> bool:
+        """Switch the index to product quantization once there's enough data to train it
+        
+        Enabling PQ on a populated collection trains the codebook on the vectors
+        already stored (512 floats -> 64 one-byte codes). Below min_vectors the
+        index stays uncompressed.
+        """
+        collection = self.client.collections.get(self.collection_name)
+        count = collection.aggregate.over_all(total_count=True).total_count
+        
+        if count < min_vectors:
+            print(f"\nℹ️  {count} embeddings, PQ needs {min_vectors} - index left uncompressed")
+            return False
+        
+        collection.config.update(
+            vector_index_config=Reconfigure.VectorIndex.hnsw(
+                quantizer=Reconfigure.VectorIndex.Quantizer.pq(
+                    segments=64,
+                    centroids=256
+                )
+            )
+        )
+        
+        print(f"\n✅ Enabled product quantization on {count} embeddings")
+        return True
+    
     def get_stats(self):
         """Get database statistics"""
         collection = self.client.collections.get(self.collection_name)
@@ -204,6 +387,40 @@ class FaceRegistrationCloud:
         print("✅ Closed Weaviate connection")
 
 
+def _init_worker(threads: int):
+    """Configure TensorFlow in a fresh worker process, before any model is built"""
+    # Without memory growth each process reserves nearly all GPU memory up front
+    for gpu in tf.config.list_physical_devices("GPU"):
+        tf.config.experimental.set_memory_growth(gpu, True)
+    
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+
+
+def _register_one(
+    cluster_url: str,
+    api_key: str,
+    person_name: str,
+    image_folder: str,
+    max_photos: int,
+    upload_batch_size: int,
+    upload_concurrency: int,
+    threads: int
+) -> Tuple[str, Dict[str, Any]]:
+    """Register one person in a worker process with its own Weaviate client and models"""
+    db = FaceRegistrationCloud(
+        cluster_url=cluster_url,
+        api_key=api_key,
+        upload_batch_size=upload_batch_size,
+        upload_concurrency=upload_concurrency,
+        threads=threads
+    )
+    
+    try:
+        return person_name, db.register_person(person_name, image_folder, max_photos)
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
     from dotenv import load_dotenv
     load_dotenv()
@@ -244,6 +461,9 @@ if __name__ == "__main__":
         # Register all people (50 photos each max)
         db.register_batch(people_to_register, max_photos_per_person=50)
         
+        # Compress the index if there's enough data to train PQ on
+        db.enable_compression()
+        
         # Show stats
         db.get_stats()
         